@@ -1,22 +1,32 @@
 import cloudscraper
 import json
+import orjson
 import random
 import time
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 import os
+import socket
+import functools
 import threading
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone, timedelta
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
 
 # -----------------------
 # CONFIG
 # -----------------------
 MAX_WORKERS = 4
-RETRY_LIMIT = 3
+RETRY_LIMIT = 5
 REQUEST_DELAY = (0.6, 1.4)
-IST = pytz.timezone("Asia/Kolkata")
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 15.0
+WRITE_BUFFER = 1 << 20  # json.dump writes in small chunks
+RANK_KEYS = tuple(f"rank{i}" for i in range(1, 9))
+IST = timezone(timedelta(hours=5, minutes=30))
 
 # -----------------------
 # DATE SETUP
@@ -48,10 +58,27 @@ file_handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(mes
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(logging.Formatter("%(message)s"))
 
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+# Workers only enqueue records; one listener thread does the file/console I/O
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+logger.addHandler(QueueHandler(log_queue))
+log_listener.start()
+atexit.register(log_listener.stop)
 
-logger.info(f"\n🚀 Starting run for {date_file_str}\n")
+logger.info("\n🚀 Starting run for %s\n", date_file_str)
+
+# -----------------------
+# DNS CACHE
+# -----------------------
+# Every new or reset identity opens a fresh connection to the same host;
+# resolve it once per run. Failed lookups raise and are not cached.
+_getaddrinfo = socket.getaddrinfo
+
+@functools.lru_cache(maxsize=16)
+def cached_getaddrinfo(*args, **kwargs):
+    return _getaddrinfo(*args, **kwargs)
+
+socket.getaddrinfo = cached_getaddrinfo
 
 # -----------------------
 # USER AGENTS
@@ -65,20 +92,15 @@ USER_AGENTS = [
 thread_local = threading.local()
 failures = []
 lock = threading.Lock()
+base_identity = None  # warmed once in main() and cloned by each worker
 
 # -----------------------
 # Identity per thread
 # -----------------------
 class Identity:
-    def __init__(self):
-        self.ua = random.choice(USER_AGENTS)
-        self.scraper = cloudscraper.create_scraper(
-            browser={"browser": "chrome", "platform": "windows", "desktop": True}
-        )
-        self.warm_session()
-
-    def headers(self):
-        return {
+    def __init__(self, base=None):
+        self.ua = base.ua if base else get_rng().choice(USER_AGENTS)
+        self._headers = {
             "User-Agent": self.ua,
             "Accept": "application/json, text/plain, */*",
             "Accept-Language": "en-IN,en;q=0.9",
@@ -86,6 +108,19 @@ class Identity:
             "Referer": "https://in.bookmyshow.com/",
             "Connection": "keep-alive"
         }
+        self.scraper = cloudscraper.create_scraper(
+            browser={"browser": "chrome", "platform": "windows", "desktop": True}
+        )
+        if base:
+            # Reuse the warmed cookies along with the UA they were issued to
+            self.scraper.cookies.update(base.scraper.cookies)
+            self.warmed = True
+        else:
+            self.warmed = self.warm_session()
+
+    def headers(self):
+        # requests merges these into its own dict, so sharing one is safe
+        return self._headers
 
     def warm_session(self):
         try:
@@ -95,25 +130,37 @@ class Identity:
                 timeout=10
             )
             logger.info("🌐 Session warmed")
+            return True
         except Exception as e:
-            logger.warning(f"Warmup failed: {e}")
+            logger.warning("Warmup failed: %s", e)
+            return False
 
 def get_identity():
     if not hasattr(thread_local, "identity"):
-        thread_local.identity = Identity()
+        thread_local.identity = Identity(base_identity)
     return thread_local.identity
 
 def reset_identity():
+    # A blocked worker warms a fresh session rather than reusing the shared cookies
     if hasattr(thread_local, "identity"):
-        del thread_local.identity
+        thread_local.identity.scraper.close()
+    thread_local.identity = Identity()
+
+def get_rng():
+    if not hasattr(thread_local, "rng"):
+        thread_local.rng = random.Random(os.urandom(8))
+    return thread_local.rng
 
 # -----------------------
 def load_cities(filename="allcities.json"):
-    with open(filename, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(filename, "rb") as f:
+        return orjson.loads(f.read())
 
+@functools.lru_cache(maxsize=8192)
 def clean_title(title):
-    return title.rsplit("(", 1)[0].strip()
+    # Drop the trailing "(...)" suffix; rfind avoids rsplit's list allocation
+    idx = title.rfind("(")
+    return (title[:idx] if idx != -1 else title).strip()
 
 # -----------------------
 def fetch_movies_for_city(city, index, total):
@@ -122,12 +169,13 @@ def fetch_movies_for_city(city, index, total):
     url = f"https://in.bookmyshow.com/quickbook-search.bms?r={region_code}"
 
     ident = get_identity()
+    rng = get_rng()
 
-    logger.info(f"[{index}/{total}] Fetching {region_name} ({region_code})")
+    logger.info("[%d/%d] Fetching %s (%s)", index, total, region_name, region_code)
 
     for attempt in range(RETRY_LIMIT):
         try:
-            time.sleep(random.uniform(*REQUEST_DELAY))
+            time.sleep(rng.uniform(*REQUEST_DELAY))
 
             response = ident.scraper.get(
                 url,
@@ -135,31 +183,42 @@ def fetch_movies_for_city(city, index, total):
                 timeout=15
             )
 
-            logger.info(f"   ↳ Status {response.status_code}")
+            logger.info("   ↳ Status %s", response.status_code)
 
             if response.status_code in (403, 429):
-                logger.warning(f"   ⚠ Blocked ({response.status_code}) retry {attempt+1}")
+                logger.warning("   ⚠ Blocked (%s) retry %d", response.status_code, attempt + 1)
+                if attempt == RETRY_LIMIT - 1:
+                    # Out of retries: record it rather than reset and sleep for nothing
+                    with lock:
+                        failures.append({
+                            "region": region_name,
+                            "code": region_code,
+                            "error": f"Blocked ({response.status_code})"
+                        })
+                    return region_name, []
                 reset_identity()
                 ident = get_identity()
-                time.sleep(2 ** attempt)
+                # Full jitter keeps blocked workers from retrying in lockstep
+                time.sleep(rng.uniform(0, min(BACKOFF_BASE * 2 ** (attempt + 1), BACKOFF_CAP)))
                 continue
 
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
 
-            hits = data.get("hits", [])
-            movies = [
-                clean_title(hit["TITLE"])
-                for hit in hits
-                if hit.get("TYPE") == "MT" and "TITLE" in hit
-            ]
+            movies = []
+            for hit in data.get("hits", []):
+                title = hit.get("TITLE")
+                if title and hit.get("TYPE") == "MT":
+                    movies.append(clean_title(title))
+                    # Only the top 8 titles are ranked, so stop scanning once we have them
+                    if len(movies) == 8:
+                        break
 
-            logger.info(f"   ✓ Found {len(movies)} movies")
-            ranked = {f"rank{i+1}": title for i, title in enumerate(movies[:8])}
-            return region_name, ranked
+            logger.info("   ✓ Found %d movies", len(movies))
+            return region_name, movies
 
         except Exception as e:
-            logger.error(f"   ❌ Error: {e}")
+            logger.error("   ❌ Error: %s", e)
             if attempt == RETRY_LIMIT - 1:
                 with lock:
                     failures.append({
@@ -167,37 +226,46 @@ def fetch_movies_for_city(city, index, total):
                         "code": region_code,
                         "error": str(e)
                     })
-                return region_name, {}
+                return region_name, []
 
-    return region_name, {}
+    return region_name, []
 
 # -----------------------
 def main():
+    global base_identity
     cities = load_cities()
     total = len(cities)
 
     all_rankings = {}
-    movie_points = defaultdict(int)
-    movie_city_count = defaultdict(set)
+    movie_points = Counter()
+    movie_city_count = Counter()
+    city_titles = {}
 
-    logger.info(f"📌 Total cities: {total}\n")
+    logger.info("📌 Total cities: %d\n", total)
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [
-            executor.submit(fetch_movies_for_city, city, i+1, total)
-            for i, city in enumerate(cities)
-        ]
+    warmed_identity = Identity()
+    if warmed_identity.warmed:
+        base_identity = warmed_identity
+    else:
+        # Nothing worth sharing; let each worker warm its own session
+        warmed_identity.scraper.close()
 
-        for future in as_completed(futures):
-            region_name, ranked_movies = future.result()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(
+            fetch_movies_for_city, cities, range(1, total + 1), repeat(total)
+        )
 
+        for region_name, ranked_movies in results:
             if ranked_movies:
-                all_rankings[region_name] = ranked_movies
-                for rank_key, movie_title in ranked_movies.items():
-                    rank = int(rank_key.replace("rank", ""))
+                all_rankings[region_name] = dict(zip(RANK_KEYS, ranked_movies))
+                for rank, movie_title in enumerate(ranked_movies, 1):
                     points = 9 - rank
                     movie_points[movie_title] += points
-                    movie_city_count[movie_title].add(region_name)
+                # Count each city once per movie: language variants clean to the
+                # same title, and allcities.json repeats some region names
+                counted = city_titles.setdefault(region_name, set())
+                movie_city_count.update(set(ranked_movies) - counted)
+                counted.update(ranked_movies)
 
     # -----------------------
     # Save Rankings
@@ -211,11 +279,11 @@ def main():
         "rankings": all_rankings
     }
 
-    with open(RANKING_FILE, "w", encoding="utf-8") as f:
+    with open(RANKING_FILE, "w", encoding="utf-8", buffering=WRITE_BUFFER) as f:
         json.dump(output, f, indent=4, ensure_ascii=False)
 
     if failures:
-        with open(FAILURE_FILE, "w", encoding="utf-8") as f:
+        with open(FAILURE_FILE, "w", encoding="utf-8", buffering=WRITE_BUFFER) as f:
             json.dump({
                 "date": date_file_str,
                 "last_updated": last_updated_str,
@@ -228,19 +296,19 @@ def main():
     # -----------------------
     logger.info("\n🏆 Top 20 Trending Movies\n")
 
-    top_movies = sorted(movie_points.items(), key=lambda x: x[1], reverse=True)[:20]
+    top_movies = movie_points.most_common(20)
 
     for idx, (movie, points) in enumerate(top_movies, 1):
-        cities_count = len(movie_city_count[movie])
-        logger.info(f"{idx:2d}. {movie:<30} | Points: {points:<4} | Cities: {cities_count}")
+        cities_count = movie_city_count[movie]
+        logger.info("%2d. %-30s | Points: %-4d | Cities: %d", idx, movie, points, cities_count)
 
     success_rate = (len(all_rankings) / total * 100) if total else 0
 
     logger.info("\n📊 Run Summary")
-    logger.info(f"   Success Cities : {len(all_rankings)}")
-    logger.info(f"   Failed Cities  : {len(failures)}")
-    logger.info(f"   Success Rate   : {round(success_rate,2)}%")
-    logger.info(f"\n✅ Rankings saved to {RANKING_FILE}\n")
+    logger.info("   Success Cities : %d", len(all_rankings))
+    logger.info("   Failed Cities  : %d", len(failures))
+    logger.info("   Success Rate   : %s%%", round(success_rate, 2))
+    logger.info("\n✅ Rankings saved to %s\n", RANKING_FILE)
 
 if __name__ == "__main__":
     main()
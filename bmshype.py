@@ -1,22 +1,23 @@
 import cloudscraper
-import json
-import random
+import orjson
 import time
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import os
+import functools
+import operator
 import threading
-import sys
+from urllib3.util.retry import Retry
 
 # -----------------------
 # GLOBALS
 # -----------------------
-scraper = cloudscraper.create_scraper()
-lock = threading.Lock()
-error_count = 0
-MAX_ERRORS = 20
+MAX_WORKERS = 20
+RETRY_ROUNDS = 3
+RETRY_BACKOFF = 5  # seconds before the first retry round, doubled each round
+REQUESTS_PER_SECOND = 20
+RANK_KEYS = tuple(f"rank{i}" for i in range(1, 9))
 raw_district_venues = []
-all_rankings = {}  # Make global so it can be accessed in the exception handler
 
 headers = {
     "User-Agent": "1M1ozilla/5.0",
@@ -26,41 +27,89 @@ headers = {
     "Referer": "https://in.bookmyshow.com/"
 }
 
+# -----------------------
+# Shared rate limiter: caps the pool's aggregate request rate
+# -----------------------
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        # Claim the next free slot under the lock, then sleep outside it
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        time.sleep(slot - now)
+
+rate_limiter = RateLimiter(REQUESTS_PER_SECOND)
+
+# -----------------------
+# Shared scraper, rebuilt between retry rounds
+# -----------------------
+def create_scraper():
+    new_scraper = cloudscraper.create_scraper()
+    # Resize cloudscraper's own HTTPS adapter (a plain HTTPAdapter would drop its
+    # TLS cipher setup): the default 10-connection pool is smaller than the worker
+    # count, so surplus sockets were discarded and re-handshaked.
+    https_adapter = new_scraper.get_adapter("https://")
+    # 429/503 are left to cloudscraper, which reads them as Cloudflare challenges
+    https_adapter.max_retries = Retry(
+        total=3, backoff_factor=0.3, status_forcelist=[500, 502, 504],
+        respect_retry_after_header=False
+    )
+    https_adapter.init_poolmanager(1, MAX_WORKERS, block=False)
+    return new_scraper
+
+scraper = create_scraper()
+
 # -----------------------
 # Load existing rankings
 # -----------------------
 def load_existing_rankings(filename="bms_movie_rankings.json"):
     if os.path.exists(filename):
-        with open(filename, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(filename, "rb") as f:
+            return orjson.loads(f.read())
     return {}
 
 # -----------------------
-def clear_console():
-    os.system("clear" if os.name != "nt" else "cls")
+# Save rankings atomically so a resume never sees a half-written file
+# -----------------------
+def save_rankings(rankings, filename="bms_movie_rankings.json"):
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(orjson.dumps(rankings))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
 # -----------------------
 def load_cities(filename="allcities.json"):
-    with open(filename, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(filename, "rb") as f:
+        return orjson.loads(f.read())
 
 # -----------------------
 # Clean movie title
 # -----------------------
+@functools.lru_cache(maxsize=8192)
 def clean_title(title):
-    return title.rsplit("(", 1)[0].strip()
+    # Drop the trailing "(...)" suffix; rfind avoids rsplit's list allocation
+    idx = title.rfind("(")
+    return (title[:idx] if idx != -1 else title).strip()
 
 # -----------------------
 # Fetch movie rankings for a city
 # -----------------------
 def fetch_movies_for_city(city):
-    global error_count
     region_name = city.get("RegionName")
     region_code = city.get("RegionCode")
     url = f"https://in.bookmyshow.com/quickbook-search.bms?r={region_code}"
 
     try:
         print(f"[>>] Fetching: {region_name} ({region_code})")
-        time.sleep(random.uniform(0.5, 1.5))  # Respectful delay
+        rate_limiter.wait()  # Respectful delay
 
         response = scraper.get(url, headers=headers, timeout=10)
 
@@ -69,97 +118,108 @@ def fetch_movies_for_city(city):
             raise Exception("Rate limited")
 
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
 
-        hits = data.get("hits", [])
-        movies = [
-            clean_title(hit["TITLE"])
-            for hit in hits
-            if hit.get("TYPE") == "MT" and "TITLE" in hit
-        ]
+        movies = []
+        for hit in data.get("hits", []):
+            title = hit.get("TITLE")
+            if title and hit.get("TYPE") == "MT":
+                movies.append(clean_title(title))
+                # Only the top 8 titles are ranked, so stop scanning once we have them
+                if len(movies) == 8:
+                    break
 
-        ranked = {f"rank{i+1}": title for i, title in enumerate(movies[:8])}
-        return region_name, ranked
+        return region_name, movies
 
     except Exception as e:
-        with lock:
-            error_count += 1
-            print(f"[!] Error fetching {region_name} ({region_code}): {e}")
-
-            if error_count >= MAX_ERRORS:
-                print("🛑 Too many errors. Saving progress and restarting...")
-
-                # Load partial rankings if exist
-                partial_data = load_existing_rankings()
+        print(f"[!] Error fetching {region_name} ({region_code}): {e}")
+        # None (not []) marks the city for another retry round
+        return region_name, None
 
-                # Merge whatever is fetched till now (thread-safe)
-                for region, data in partial_data.items():
-                    all_rankings[region] = data  # all_rankings should be made global
-
-                with open("bms_movie_rankings.json", "w", encoding="utf-8") as f:
-                    json.dump(all_rankings, f, indent=4, ensure_ascii=False)
+# -----------------------
+# Score rankings resumed from a previous run
+# -----------------------
+def score_existing_rankings(existing_rankings):
+    movie_points = Counter()
+    movie_city_count = Counter()
 
-                time.sleep(3)
-                clear_console()
-                os.execv(sys.executable, ['python'] + sys.argv)
+    for ranked_movies in existing_rankings.values():
+        ranked_titles = set()
+        for rank_key, movie_title in ranked_movies.items():
+            rank = rank_key.removeprefix("rank")
+            if not rank.isdecimal():
+                continue
+            points = 9 - int(rank)
+            movie_points[movie_title] += points
+            ranked_titles.add(movie_title)
+        movie_city_count.update(ranked_titles)
 
-        return region_name, {}
+    return movie_points, movie_city_count
 
 # -----------------------
 # Main logic
 # -----------------------
 def main():
-    global all_rankings
+    global scraper
     cities = load_cities()
     existing_rankings = load_existing_rankings()
     all_rankings = dict(existing_rankings)
 
-    movie_points = defaultdict(int)
-    movie_city_count = defaultdict(set)
+    movie_points, movie_city_count = score_existing_rankings(existing_rankings)
+    city_titles = {}
 
+    existing_names = frozenset(existing_rankings)
+    region_name_of = operator.itemgetter("RegionName")
     pending_cities = [
         city for city in cities
-        if city.get("RegionName") not in existing_rankings
+        if region_name_of(city) not in existing_names
     ]
 
     print(f"📌 Total cities: {len(cities)}")
     print(f"⏭️ Skipping {len(cities) - len(pending_cities)} already fetched")
 
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        futures = [executor.submit(fetch_movies_for_city, city) for city in pending_cities]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for retry_round in range(RETRY_ROUNDS + 1):
+            failed_cities = []
+            results = executor.map(fetch_movies_for_city, pending_cities)
 
-        for future in as_completed(futures):
-            region_name, ranked_movies = future.result()
-            if ranked_movies:
-                all_rankings[region_name] = ranked_movies
+            for city, (region_name, ranked_movies) in zip(pending_cities, results):
+                if ranked_movies is None:
+                    failed_cities.append(city)
+                elif ranked_movies:
+                    all_rankings[region_name] = dict(zip(RANK_KEYS, ranked_movies))
 
-                for rank_key, movie_title in ranked_movies.items():
-                    try:
-                        rank = int(rank_key.replace("rank", ""))
+                    for rank, movie_title in enumerate(ranked_movies, 1):
                         points = 9 - rank
                         movie_points[movie_title] += points
-                        movie_city_count[movie_title].add(region_name)
-                    except:
-                        continue
+                    # Count each city once per movie: language variants clean to the
+                    # same title, and allcities.json repeats some region names
+                    counted = city_titles.setdefault(region_name, set())
+                    movie_city_count.update(set(ranked_movies) - counted)
+                    counted.update(ranked_movies)
 
-    for region_name, ranked_movies in existing_rankings.items():
-        for rank_key, movie_title in ranked_movies.items():
-            try:
-                rank = int(rank_key.replace("rank", ""))
-                points = 9 - rank
-                movie_points[movie_title] += points
-                movie_city_count[movie_title].add(region_name)
-            except:
-                continue
+            # Checkpoint every round so an interrupted run can resume
+            save_rankings(all_rankings)
+
+            if not failed_cities or retry_round == RETRY_ROUNDS:
+                break
+
+            delay = RETRY_BACKOFF * 2 ** retry_round
+            print(f"🔁 Retrying {len(failed_cities)} failed cities in {delay}s...")
+            # The shared session may be flagged; retry on fresh cookies and sockets
+            scraper.close()
+            scraper = create_scraper()
+            time.sleep(delay)
+            pending_cities = failed_cities
 
-    with open("bms_movie_rankings.json", "w", encoding="utf-8") as f:
-        json.dump(all_rankings, f, indent=4, ensure_ascii=False)
+    if failed_cities:
+        print(f"⚠️ {len(failed_cities)} cities still failing; rerun to resume them")
 
-    top_movies = sorted(movie_points.items(), key=lambda x: x[1], reverse=True)[:20]
+    top_movies = movie_points.most_common(20)
 
     print("\n🏆 Top 20 Trending Movies:\n")
     for idx, (movie, points) in enumerate(top_movies, 1):
-        cities_count = len(movie_city_count[movie])
+        cities_count = movie_city_count[movie]
         print(f"{idx:2d}. {movie:<30} | 🎯 Points: {points:<4} | 🌍 Trending in: {cities_count} cities")
 
     print("\n✅ Done. Results saved to bms_movie_rankings.json")